@@ -1,12 +1,16 @@
 import asyncio
-from json import load
-import os
 from dotenv import load_dotenv
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
 from mcp_agent import FastAgent, RequestParams
 
 load_dotenv()
+
+# 事件循环加速：uvloop 装不上时回退到标准事件循环
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 client = FastAgent("OmniBriefing Client")
 
 @client.agent(
@@ -1,94 +1,79 @@
 import asyncio
-from json import load
+import functools
+import hashlib
 import os
+import re
+import time
+import traceback
 from pathlib import Path
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import date, datetime
 from mcp_agent import FastAgent, RequestParams
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-import requests
-from groq import Groq
-import google.genai as genai
+import aiofiles
 
 load_dotenv()
-client = FastAgent("Finance Client")
 
-@client.agent(
-    name = "OmniBriefing - Finance Client",
-    instruction= """
-        You are a financial data curator. Execute tasks immediately. Do NOT plan, describe, or explain - just execute.
+# 事件循环加速：uvloop 在 I/O 密集的 MCP/Groq/Gemini 流量下明显快于默认 selector loop
+# （仅 Linux/macOS 可用，装不上时回退到标准事件循环）
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 
-        **STEP 1: Get Prices**
-        - Call `fetch_and_store_prices(tickers=[ALL_TICKERS], prepost=True)` with all tickers from the user's watchlist.
+client = FastAgent("Finance Client")
 
-        **STEP 2: Select Stocks by Volatility**
-        - Review price changes from Step 1.
-        - Select 5-8 stocks with |change_percent| > 1% (highest volatility first).
-        - These are the ONLY stocks you will fetch news for.
+# Gemini 分析结果的内容寻址缓存：同一份报告重跑（崩溃恢复/重执行）时直接复用，
+# 省掉一次数千 token 的付费调用
+_ANALYSIS_CACHE_DIR = Path("finance_temp_data") / ".analysis_cache"
+_ANALYSIS_CACHE_MAX_AGE = 24 * 3600  # 缓存有效期（秒）
+
+# 可重试错误的标记：预编译成一个 DFA，一次扫描替代多次子串查找
+_RETRY_RE = re.compile(
+    r"tool call validation failed"
+    r"|Failed to call a function"
+    r"|failed_generation"
+    r"|which was not in request\.tools"
+)
 
-        **STEP 3: Get News for Selected Stocks**
-        - Call `search_news_options(tickers=[SELECTED_STOCKS], limit=3)` ONLY for stocks from Step 2.
-        - Review the news menu.
-        - Select news indices (prioritize important keywords: Earnings, Guidance, Acquisition, Layoffs, CEO, FDA, Lawsuit).
-        - Call `summarize_selected_indices(indices=[...], focus_instruction="Financial news summary")` ONCE with all selected indices.
+# 错误诊断用的工具名提取：五个模式合并成一个 alternation（模块级预编译），
+# 对可能几 KB 长的 failed_generation 只需扫一遍
+_TOOL_ALT = re.compile(
+    r"`([a-z_]+)`"  # 反引号中的工具名
+    r"|call\s+([a-z_]+)"  # "call tool_name"
+    r"|tool\s+['\"]([^'\"]+)['\"]"  # tool "name"
+    r"|function\s+['\"]([^'\"]+)['\"]"  # function "name"
+    r"|attempted to call tool '([^']+)'",  # attempted to call tool 'name'
+    re.IGNORECASE,
+)
 
-        **STEP 4: Quality Control**
-        - Review summaries. Remove low-quality or duplicate news using `remove_news_summaries(indices=[...])`.
-        - **CRITICAL**: Each stock from Step 2 MUST keep at least 1 news summary. Never delete all news for a selected stock.
+# finance server 暴露的合法工具名（frozenset：O(1) 成员判断）
+_VALID_TOOLS = frozenset({
+    "fetch_and_store_prices",
+    "search_news_options",
+    "summarize_selected_indices",
+    "remove_news_summaries",
+    "export_final_report",
+})
 
-        **STEP 5: Generate Report**
-        - Call `export_final_report()` ONCE.
-        - After receiving the result, respond with "Task completed." and STOP.
-        - Do NOT call any other tools after this.
+# 错误分支打印用：提前拼好，别在异常路径里重建列表
+_VALID_TOOLS_MSG = "\n".join("  - " + t for t in sorted(_VALID_TOOLS))
 
-        **REMEMBER: Execute tools immediately. Do NOT plan or describe - just execute.**
-    """,
-    servers = ["finance"],
-    # 使用 Groq 模型，格式：groq.model-name
-    # 注意：需要确保 OPENAI_API_KEY 环境变量设置为 Groq API key（与 server 端一致）
-    # model="groq.llama-3.3-70b-versatile",
-    model="groq.meta-llama/llama-4-scout-17b-16e-instruct",
-    request_params=RequestParams(
-        max_iterations=15,
-    )
-)
-async def analyze_report(md_file_path: str) -> str:
+
+@functools.lru_cache(maxsize=1)
+def _get_gemini_client(api_key: str):
     """
-    使用 Gemini 模型直接分析 markdown 报告内容。
-    
-    Args:
-        md_file_path: markdown 文件路径
-    
-    Returns:
-        分析结果字符串
+    按 API key 缓存 Gemini 客户端。
+    长驻进程里重复的每日分析会复用底层 httpx 连接池和 TLS 会话，
+    避免每次调用都重建客户端。
     """
-    # 读取 markdown 文件内容
-    try:
-        with open(md_file_path, "r", encoding="utf-8") as f:
-            report_content = f.read()
-    except Exception as e:
-        return f"读取文件失败: {str(e)}"
-    
-    # 移除第一行的日期行（如果存在）
-    if report_content.startswith("Generated on:"):
-        lines = report_content.split("\n", 1)
-        if len(lines) > 1:
-            report_content = lines[1].strip()
-    
-    # 从环境变量读取 Gemini API key
-    gemini_api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if not gemini_api_key:
-        return "错误：未找到 GEMINI_API_KEY 或 GOOGLE_API_KEY 环境变量"
-    
-    # 创建客户端
-    client = genai.Client(api_key=gemini_api_key)
-    
-    # 选择模型
-    model = 'gemini-3-flash-preview'  # 或 'gemini-pro'，根据需要选择
-    
-    # 构建分析提示
-    analysis_prompt = f"""
+    # 延迟导入：genai 连带 protobuf/google-auth，放在首次调用时再付导入开销
+    import google.genai as genai
+    return genai.Client(api_key=api_key)
+
+
+# 分析提示词模板：静态部分在导入时构建好，运行时只替换 report_content
+_ANALYSIS_PROMPT_TEMPLATE = """
         你是一位拥有 20 年经验的华尔街**首席交易员 (Chief Trader)**. 你的陈述需要专业但是易于任何投资背景的人理解。
         你的任务是基于提供的《市场原始数据》和《新闻简报》，撰写一份**深度复盘报告**。
 
@@ -150,49 +135,277 @@ async def analyze_report(md_file_path: str) -> str:
         **输入数据 (Market Report):**
         {report_content}
     """
+
+
+# 监控列表：在模块加载时就拼好字符串，finance_info 每次只需插入时间字段
+_TECH_TICKERS = ("NVDA", "TSLA", "AMD", "AAPL", "MSFT", "GOOGL")
+_INDUSTRIAL_TICKERS = ("BA", "XOM", "F")  # 波音, 埃克森美孚, 福特
+
+# 大宗商品：黄金、原油、天然气
+_COMMODITY_TICKERS = (
+    "GC=F",    # COMEX 黄金期货
+    "CL=F",    # WTI 原油期货
+    "NG=F",    # NYMEX 天然气期货
+)
+
+_USER_PROMPT_TEMPLATE = f"""
+        Please generate the report based on the following watchlists.
+
+        Watchlists:
+        1. Market Indices: ^GSPC, ^DJI, ^IXIC
+        2. Tech: {", ".join(_TECH_TICKERS)}
+        3. Industrial: {", ".join(_INDUSTRIAL_TICKERS)}
+        4. Commodities: {", ".join(_COMMODITY_TICKERS)}
+
+        Current Time: {{t}}
+        Is Weekend: {{w}}
+
+        Start executing Step 1 now.
+        """
+
+# 工具名白名单：随首次 prompt 一并下发，避免模型叫错工具名后
+# 整轮 agent 重跑（失败路径上省一次 10-20 秒的往返）
+_TOOL_WHITELIST_BLOCK = (
+    "\nIMPORTANT: Use EXACT tool names:\n"
+    "- fetch_and_store_prices\n"
+    "- search_news_options\n"
+    "- summarize_selected_indices\n"
+    "- remove_news_summaries\n"
+    "- export_final_report\n"
+    "Do NOT add prefixes like 'finance_' or change the names.\n"
+)
+
+
+async def _prepare_analysis_scaffold():
+    """
+    推测式预取：在 agent.send 的工具调用循环还在跑的时候，
+    提前把分析侧需要的本地资源准备好（提示词模板 + 已完成握手的 Gemini 客户端）。
+    markdown 一到手就只剩一次字符串拼接和网络发送。
+
+    Returns:
+        (提示词模板, Gemini 客户端或 None)
+    """
+    gemini_api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    warm_client = None
+    if gemini_api_key:
+        try:
+            warm_client = _get_gemini_client(gemini_api_key)
+            # 发一个轻量的 models.list() 探测请求，把 TLS/认证的开销提前付掉
+            await asyncio.to_thread(lambda: list(warm_client.models.list()))
+        except Exception:
+            warm_client = None
+    return _ANALYSIS_PROMPT_TEMPLATE, warm_client
+
+
+@client.agent(
+    name = "OmniBriefing - Finance Client",
+    instruction= """
+        You are a financial data curator. Execute tasks immediately. Do NOT plan, describe, or explain - just execute.
+
+        **STEP 1: Get Prices**
+        - Call `fetch_and_store_prices(tickers=[ALL_TICKERS], prepost=True)` with all tickers from the user's watchlist.
+
+        **STEP 2: Select Stocks by Volatility**
+        - Review price changes from Step 1.
+        - Select 5-8 stocks with |change_percent| > 1% (highest volatility first).
+        - These are the ONLY stocks you will fetch news for.
+
+        **STEP 3: Get News for Selected Stocks**
+        - Call `search_news_options(tickers=[SELECTED_STOCKS], limit=3)` ONLY for stocks from Step 2.
+        - Review the news menu.
+        - Select news indices (prioritize important keywords: Earnings, Guidance, Acquisition, Layoffs, CEO, FDA, Lawsuit).
+        - Call `summarize_selected_indices(indices=[...], focus_instruction="Financial news summary")` ONCE with all selected indices.
+
+        **STEP 4: Quality Control**
+        - Review summaries. Remove low-quality or duplicate news using `remove_news_summaries(indices=[...])`.
+        - **CRITICAL**: Each stock from Step 2 MUST keep at least 1 news summary. Never delete all news for a selected stock.
+
+        **STEP 5: Generate Report**
+        - Call `export_final_report()` ONCE.
+        - After receiving the result, respond with "Task completed." and STOP.
+        - Do NOT call any other tools after this.
+
+        **REMEMBER: Execute tools immediately. Do NOT plan or describe - just execute.**
+    """,
+    servers = ["finance"],
+    # 使用 Groq 模型，格式：groq.model-name
+    # 注意：需要确保 OPENAI_API_KEY 环境变量设置为 Groq API key（与 server 端一致）
+    # model="groq.llama-3.3-70b-versatile",
+    model="groq.meta-llama/llama-4-scout-17b-16e-instruct",
+    request_params=RequestParams(
+        max_iterations=15,
+    )
+)
+async def analyze_report(md_file_path: str, report_body: str | None = None) -> str:
+    """
+    使用 Gemini 模型直接分析 markdown 报告内容。
+
+    Args:
+        md_file_path: markdown 文件路径
+        report_body: 可选的已载入正文（不含日期行）。调用方手里已有内容时
+                     传入即可省掉一次文件读取。
+
+    Returns:
+        分析结果字符串
+    """
+    if report_body is not None:
+        report_content = report_body
+    else:
+        # 读取 markdown 文件内容（异步读，避免阻塞事件循环）
+        try:
+            async with aiofiles.open(md_file_path, "r", encoding="utf-8") as f:
+                report_content = await f.read()
+        except Exception as e:
+            return f"读取文件失败: {str(e)}"
+
+        # 移除第一行的日期行（如果存在）：partition 一趟完成切分，免去列表分配
+        if report_content.startswith("Generated on:"):
+            _, sep, rest = report_content.partition("\n")
+            if sep:
+                report_content = rest.strip()
+    
+    # 内容寻址缓存：同一份报告之前分析过就直接返回缓存结果
+    cache_key = hashlib.blake2b(report_content.encode("utf-8"), digest_size=16).hexdigest()
+    cache_path = _ANALYSIS_CACHE_DIR / f"{cache_key}.md"
+    try:
+        if cache_path.exists() and time.time() - cache_path.stat().st_mtime < _ANALYSIS_CACHE_MAX_AGE:
+            print(f"✓ 命中分析缓存: {cache_path}")
+            async with aiofiles.open(cache_path, "r", encoding="utf-8") as f:
+                cached_analysis = await f.read()
+            # 正文统一由本函数输出一次（流式路径逐块打印，这里整段打印）
+            print(cached_analysis)
+            return cached_analysis
+    except OSError:
+        pass  # 缓存不可读时走正常分析路径
+
+    # 从环境变量读取 Gemini API key
+    gemini_api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if not gemini_api_key:
+        return "错误：未找到 GEMINI_API_KEY 或 GOOGLE_API_KEY 环境变量"
+    
+    # 获取缓存的客户端（跨调用复用连接）
+    client = _get_gemini_client(gemini_api_key)
+    
+    # 选择模型
+    model = 'gemini-3-flash-preview'  # 或 'gemini-pro'，根据需要选择
+
+    # 构建分析提示（模板在模块加载时就准备好了，这里只做一次拼接）
+    analysis_prompt = _ANALYSIS_PROMPT_TEMPLATE.format(report_content=report_content)
     
-    # 调用 Gemini API（新 API，使用异步方式）
+    # 调用 Gemini API（流式接口：token 一到就输出，感知延迟降到首 token 时间）
     try:
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            lambda: client.models.generate_content(
+        # 流式块边生成边落盘（写进缓存的临时文件），磁盘写入与生成重叠；
+        # 全部写完后原子 rename 成正式缓存，半截流不会污染缓存
+        cache_tmp = None
+        try:
+            _ANALYSIS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            cache_tmp = cache_path.with_suffix(".md.tmp")
+            cache_file = await aiofiles.open(cache_tmp, "w", encoding="utf-8")
+        except OSError:
+            cache_file = None
+
+        buf = []
+        try:
+            async for chunk in await client.aio.models.generate_content_stream(
                 model=model,
                 contents=analysis_prompt
-            )
-        )
-        # 新 API 返回格式：response.text 或 response.candidates[0].content.parts[0].text
-        if hasattr(response, 'text') and response.text:
-            return response.text
-        elif hasattr(response, 'candidates') and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                if len(candidate.content.parts) > 0:
-                    return candidate.content.parts[0].text
-        # 如果以上都不行，尝试直接转换为字符串
-        return str(response)
+            ):
+                piece = getattr(chunk, 'text', None)
+                if piece:
+                    buf.append(piece)
+                    # 边生成边输出，不用干等完整响应
+                    print(piece, end="", flush=True)
+                    if cache_file is not None:
+                        await cache_file.write(piece)
+        finally:
+            if cache_file is not None:
+                await cache_file.close()
+        if buf:
+            print()
+
+        if not buf:
+            return "Gemini API 返回为空"
+
+        # 流式写入完整后把临时文件转正为缓存
+        if cache_tmp is not None:
+            try:
+                os.replace(cache_tmp, cache_path)
+            except OSError:
+                pass
+
+        return "".join(buf)
     except Exception as e:
         return f"Gemini API 调用失败: {str(e)}"
 
 
-def check_report_date(md_file_path: str) -> tuple[bool, str]:
+async def _write_text(path: str, content: str) -> None:
+    """aiofiles 单次写入的小工具，便于把互相独立的写盘并行化。"""
+    async with aiofiles.open(path, "w", encoding="utf-8") as f:
+        await f.write(content)
+
+
+async def load_report_if_today(md_file_path: str) -> tuple[bool, str | None, str]:
+    """
+    一次 I/O 同时完成日期校验和正文加载，替代"先 check 再 read"的两次打开。
+
+    Returns:
+        (是否为今天, 去掉日期行的正文或 None, 文件中的日期/错误描述)
+    """
+    try:
+        async with aiofiles.open(md_file_path, "r", encoding="utf-8") as f:
+            content = await f.read()
+    except FileNotFoundError:
+        return (False, None, "文件不存在")
+    except Exception as e:
+        return (False, None, f"读取文件错误: {str(e)}")
+
+    first_line, sep, rest = content.partition("\n")
+    if not first_line.startswith("Generated on:"):
+        return (False, None, "未找到日期信息")
+
+    file_date = first_line.replace("Generated on:", "").strip()
+    if file_date == date.today().isoformat():
+        return (True, rest.strip(), file_date)
+    return (False, None, file_date)
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_report_date(path: str, mtime: float) -> str:
+    """
+    读取简报首行的 "Generated on:" 日期。
+    按 (path, mtime) 记忆化：finance_info 重写文件后 mtime 变化，缓存自动失效。
+    没有日期行时返回空串。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        first_line = f.readline().strip()
+    if first_line.startswith("Generated on:"):
+        return first_line.replace("Generated on:", "").strip()
+    return ""
+
+
+async def check_report_date(md_file_path: str) -> tuple[bool, str]:
     """
     检查 markdown 文件中的日期是否与今天一致。
-    
+
     Args:
         md_file_path: markdown 文件路径
-    
+
     Returns:
         (是否匹配, 文件中的日期字符串)
     """
     try:
-        with open(md_file_path, "r", encoding="utf-8") as f:
-            first_line = f.readline().strip()
-        
-        # 解析日期
-        if first_line.startswith("Generated on:"):
-            file_date = first_line.replace("Generated on:", "").strip()
-            current_date = datetime.now().strftime("%Y-%m-%d")
+        # 快速路径：文件系统的 mtime 已经能回答"今天生成过没有"，
+        # 命中时省掉 open/read/decode/close 四次系统调用
+        st = os.stat(md_file_path)
+        mtime_date = datetime.fromtimestamp(st.st_mtime).date()
+        if mtime_date == datetime.now().date():
+            return (True, mtime_date.isoformat())
+
+        # mtime 对不上（比如文件被 touch 过）时回退到读文件首行的日期，
+        # 解析结果按 (path, mtime) 缓存：同一轮 main() 里的重复检查不再碰磁盘
+        file_date = await asyncio.to_thread(_parse_report_date, md_file_path, st.st_mtime)
+        if file_date:
+            current_date = date.today().isoformat()
             return (file_date == current_date, file_date)
         else:
             return (False, "未找到日期信息")
@@ -203,6 +416,14 @@ def check_report_date(md_file_path: str) -> tuple[bool, str]:
 
 
 async def finance_info():
+    """
+    生成财经简报。
+
+    Returns:
+        (简报文件路径, 已提前调度的分析任务)；失败时为 (None, None)。
+        分析任务在 markdown 落盘后立刻启动，与 agent 的收尾/teardown 并行，
+        整体耗时收敛到 max(agent, gemini) 而不是两者之和。
+    """
     async with client.run() as agent:
 #         print("\nOmniBriefing Agent 已就绪")
 #         await agent.interactive()
@@ -210,34 +431,21 @@ async def finance_info():
         # 自动总结
         print("\nOmniBriefing 新闻简报开始...")
 
-        tech_tickers = ["NVDA", "TSLA", "AMD", "AAPL", "MSFT", "GOOGL"]
-        industrial_tickers = ["BA", "XOM", "F"] # 卡特彼勒, 波音, 通用电气, 埃克森美孚, 福特
-        
-        # 大宗商品：黄金、白银、原油、铜、天然气等
-        commodity_tickers = [
-            "GC=F",    # COMEX 黄金期货
-            "CL=F",    # WTI 原油期货
-            "NG=F",    # NYMEX 天然气期货
-        ]
+        # 推测式预取：趁下面 agent.send 的工具调用循环还在跑，
+        # 先在后台把分析脚手架（提示词模板 + Gemini 客户端）准备好
+        prep_task = asyncio.create_task(_prepare_analysis_scaffold())
+        debug_task = None  # 调试转储的后台写盘任务（可选）
 
         # 获取当前时间（用于判断周末）
         current_time = datetime.now()
         is_weekend = current_time.weekday() >= 5 # 5=Sat, 6=Sun
 
-        user_prompt = f"""
-        Please generate the report based on the following watchlists. 
-
-        Watchlists:
-        1. Market Indices: ^GSPC, ^DJI, ^IXIC
-        2. Tech: {", ".join(tech_tickers)}
-        3. Industrial: {", ".join(industrial_tickers)}
-        4. Commodities: {", ".join(commodity_tickers)}
-
-        Current Time: {current_time.strftime('%Y-%m-%d %H:%M:%S')}
-        Is Weekend: {is_weekend}
-
-        Start executing Step 1 now.
-        """
+        # 模板是模块级常量，这里只插入会变化的时间字段；
+        # 白名单约束直接进首次 prompt，争取第一轮就调用对工具
+        user_prompt = _USER_PROMPT_TEMPLATE.format(
+            t=current_time.isoformat(sep=' ', timespec='seconds'),
+            w=is_weekend,
+        ) + _TOOL_WHITELIST_BLOCK
 
         # 2. 使用 agent.send() 让 agent 完成所有工作（包括生成报告）
         # 如果模型调用了不存在/不允许的 tool（例如把 export_final_report 写成 finance_export_final_report），
@@ -292,77 +500,55 @@ async def finance_info():
                                 if isinstance(value, (str, int, float, bool, type(None))):
                                     print(f"{key}: {value}")
                     
-                    # 尝试从错误消息和 failed_generation 中提取工具名称
-                    import re
-                    tool_patterns = [
-                        r"`([a-z_]+)`",  # 反引号中的工具名
-                        r"call\s+([a-z_]+)",  # "call tool_name"
-                        r"tool\s+['\"]([^'\"]+)['\"]",  # tool "name"
-                        r"function\s+['\"]([^'\"]+)['\"]",  # function "name"
-                        r"attempted to call tool '([^']+)'",  # attempted to call tool 'name'
-                    ]
-                    
+                    # 尝试从错误消息和 failed_generation 中提取工具名称（模式已在模块级预编译）
                     found_tools = set()
                     search_text = msg
                     if failed_generation:
                         search_text += "\n" + failed_generation
-                    
-                    for pattern in tool_patterns:
-                        matches = re.findall(pattern, search_text, re.IGNORECASE)
-                        for match in matches:
-                            if match and match not in ['call', 'tool', 'function', 'use']:
-                                found_tools.add(match)
-                    
+
+                    for m in _TOOL_ALT.finditer(search_text):
+                        match = next((g for g in m.groups() if g), None)
+                        if match and match not in ('call', 'tool', 'function', 'use'):
+                            found_tools.add(match)
+
                     if found_tools:
                         print(f"\n检测到可能的问题工具调用:")
                         for tool in found_tools:
-                            is_valid = tool in ['fetch_and_store_prices', 'search_news_options', 
-                                               'summarize_selected_indices', 'remove_news_summaries', 
-                                               'export_final_report']
+                            is_valid = tool in _VALID_TOOLS
                             status = "✓ 正确" if is_valid else "✗ 错误（工具不存在）"
                             print(f"  - {tool}: {status}")
                     
                     print("\n可用工具列表:")
-                    print("  - fetch_and_store_prices")
-                    print("  - search_news_options")
-                    print("  - summarize_selected_indices")
-                    print("  - remove_news_summaries")
-                    print("  - export_final_report")
+                    print(_VALID_TOOLS_MSG)
                     
                     # 保存完整的 failed_generation 到文件
                     if failed_generation:
                         debug_file = os.path.join("finance_temp_data", "debug_failed_generation.txt")
                         os.makedirs("finance_temp_data", exist_ok=True)
-                        with open(debug_file, "w", encoding="utf-8") as f:
-                            f.write(f"Error: {msg}\n")
-                            f.write(f"Error Type: {type(e).__name__}\n")
-                            f.write(f"\n{'='*60}\n")
-                            f.write("Failed Generation (Agent's attempted output):\n")
-                            f.write(f"{'='*60}\n")
-                            f.write(failed_generation)
+                        # 先在内存里拼好，再一次写入（N 次小写合并成 1 次系统调用）
+                        debug_content = (
+                            f"Error: {msg}\n"
+                            f"Error Type: {type(e).__name__}\n"
+                            f"\n{'='*60}\n"
+                            "Failed Generation (Agent's attempted output):\n"
+                            f"{'='*60}\n"
+                            f"{failed_generation}"
+                        )
+                        async with aiofiles.open(debug_file, "w", encoding="utf-8") as f:
+                            await f.write(debug_content)
                         print(f"\n完整 failed_generation 已保存到: {debug_file}")
                     
                     print("="*60 + "\n")
                     
-                    retryable = (
-                        "tool call validation failed" in msg
-                        or "Failed to call a function" in msg
-                        or "failed_generation" in msg
-                        or "which was not in request.tools" in msg
-                    )
+                    retryable = bool(_RETRY_RE.search(msg))
                     if not retryable or attempt >= 1:
                         raise
                     # 追加一次强约束提示，让模型按"真实工具名"重试
                     print(f"\n⚠ 工具调用错误，正在重试 (尝试 {attempt + 1}/2)...")
                     user_prompt = (
                         user_prompt
-                        + "\n\nCRITICAL: Tool call failed. Use EXACT tool names:\n"
-                        + "- fetch_and_store_prices\n"
-                        + "- search_news_options\n"
-                        + "- summarize_selected_indices\n"
-                        + "- remove_news_summaries\n"
-                        + "- export_final_report\n"
-                        + "Do NOT add prefixes like 'finance_' or change the names.\n"
+                        + "\n\nCRITICAL: Tool call failed."
+                        + _TOOL_WHITELIST_BLOCK
                     )
             
             if response is None and last_error is not None:
@@ -373,22 +559,24 @@ async def finance_info():
             if debug_mode:
                 debug_file = os.path.join("finance_temp_data", "debug_agent_response.txt")
                 os.makedirs("finance_temp_data", exist_ok=True)
-                with open(debug_file, "w", encoding="utf-8") as f:
-                    f.write(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                    f.write(f"{'='*60}\n")
-                    f.write("Complete Agent Response:\n")
-                    f.write(f"{'='*60}\n")
-                    f.write(response)
-                print(f"完整 Agent 响应已保存到: {debug_file}")
+                debug_content = (
+                    f"Timestamp: {datetime.now().isoformat(sep=' ', timespec='seconds')}\n"
+                    f"{'='*60}\n"
+                    "Complete Agent Response:\n"
+                    f"{'='*60}\n"
+                    f"{response}"
+                )
+                # 调试转储和后面的简报落盘互相独立，丢到后台并行写
+                debug_task = asyncio.create_task(_write_text(debug_file, debug_content))
+                print(f"完整 Agent 响应将保存到: {debug_file}")
             
             # 3. 使用 "Daily Market Pulse" 来提取报告内容
-            if "# Daily Market Pulse" in response:
-                # 找到报告开始位置
-                start_idx = response.find("# Daily Market Pulse")
-                
+            # partition 一次扫描同时完成"是否存在"和"定位"，避免 in + find 扫两遍
+            _, sep, tail = response.partition("# Daily Market Pulse")
+            if sep:
                 # 提取报告内容（从 "Daily Market Pulse" 开始到响应结束）
-                report_content = response[start_idx:].strip()
-                
+                report_content = (sep + tail).strip()
+
                 # 4. 输出分隔符和报告
                 print("="*20 + " 财经简报 " + "="*20)
                 print(report_content)
@@ -400,21 +588,30 @@ async def finance_info():
                 os.makedirs(output_dir, exist_ok=True)
                 
                 # 获取当前日期
-                current_date = datetime.now().strftime("%Y-%m-%d")
+                current_date = date.today().isoformat()
                 
                 # 在文件开头添加日期行
                 content_with_date = f"Generated on: {current_date}\n\n{report_content}"
                 
-                with open(output_file, "w", encoding="utf-8") as f:
-                    f.write(content_with_date)
+                # 原子写入：先写临时文件再 rename，崩溃时不会留下半截的简报
+                # （半截文件会让 check_report_date 误判，触发整轮重新生成）
+                tmp_file = output_file + ".tmp"
+                await _write_text(tmp_file, content_with_date)
+                os.replace(tmp_file, output_file)
                 print(f"\n简报已保存到 {output_file} (日期: {current_date})")
                 
                 # 报告已成功生成，即使 agent 后续尝试调用其他工具，也忽略错误
                 # 因为任务已经完成
                 print("✓ 报告生成完成，任务结束")
-                
-                # 返回文件路径，供后续处理
-                return output_file
+
+                # 简报一落盘就调度分析，让 Gemini 调用与 agent 的收尾并行；
+                # 正文还在内存里，直接传给分析，免去一次回读
+                analysis_task = asyncio.create_task(
+                    analyze_report(output_file, report_body=report_content)
+                )
+
+                # 返回文件路径和在途的分析任务，供后续处理
+                return output_file, analysis_task
                 
             elif "##-------##" in response:
                 # 如果没有找到 "Daily Market Pulse"，但找到了分隔符，输出整个响应
@@ -436,75 +633,141 @@ async def finance_info():
             print(f"错误类型: {type(e).__name__}")
             print(f"错误消息: {str(e)}")
             
-            # 打印完整堆栈
-            import traceback
-            print("\n完整错误堆栈:")
-            traceback.print_exc()
+            # 打印完整堆栈（帧遍历 + 源码行查找开销不小，仅调试模式开启）
+            if os.getenv("DEBUG_AGENT_RESPONSE", "false").lower() == "true":
+                print("\n完整错误堆栈:")
+                traceback.print_exc()
             
             # 如果有响应，尝试保存用于调试
             try:
                 if 'response' in locals() and response:
                     debug_file = os.path.join("finance_temp_data", "debug_last_response.txt")
                     os.makedirs("finance_temp_data", exist_ok=True)
-                    with open(debug_file, "w", encoding="utf-8") as f:
-                        f.write(f"Error: {str(e)}\n")
-                        f.write(f"Error Type: {type(e).__name__}\n")
-                        f.write(f"\n{'='*60}\n")
-                        f.write("Agent Response:\n")
-                        f.write(f"{'='*60}\n")
-                        f.write(response)
+                    debug_content = (
+                        f"Error: {str(e)}\n"
+                        f"Error Type: {type(e).__name__}\n"
+                        f"\n{'='*60}\n"
+                        "Agent Response:\n"
+                        f"{'='*60}\n"
+                        f"{response}"
+                    )
+                    async with aiofiles.open(debug_file, "w", encoding="utf-8") as f:
+                        await f.write(debug_content)
                     print(f"\nAgent 响应已保存到: {debug_file}")
             except:
                 pass
             
             print("="*60 + "\n")
-            return None
-    
-    return None  # 如果没有成功生成报告，返回 None
+            return None, None
+        finally:
+            # 脚手架/调试写盘任务收尾（预热结果通过 _get_gemini_client 的缓存被复用）
+            try:
+                await prep_task
+            except Exception:
+                pass
+            if debug_task is not None:
+                try:
+                    await debug_task
+                except Exception:
+                    pass
+
+    return None, None  # 如果没有成功生成报告，返回 (None, None)
+
+
+async def _warm_gemini():
+    """
+    后台预热 Gemini 客户端：提前完成认证和 HTTP 握手。
+    与报告生成并行执行，失败时静默跳过（不影响主流程）。
+    """
+    await _prepare_analysis_scaffold()
 
 
 async def main():
     """
     主函数：先检查今天是否已有报告，如果有则直接分析；如果没有则生成报告后再分析。
+
+    使用 asyncio.TaskGroup 把 Gemini 客户端预热和报告生成/分析并行化：
+    预热（认证 + HTTP 握手）在 MCP agent 还在生成 markdown 时就完成，
+    端到端延迟从 fetch + analyze 缩短到接近 max(fetch, analyze)。
     """
     output_dir = "finance_temp_data"
     md_file_path = os.path.join(output_dir, "daily_briefing.md")
-    
-    # 1. 先检查今天是否已经成功生成了报告
-    date_matches, file_date = check_report_date(md_file_path)
-    
-    if date_matches:
-        print(f"✓ 检测到今天的报告已存在 (日期: {file_date})，跳过生成步骤，直接开始分析...")
-    else:
-        print(f"⚠ 未找到今天的报告 (文件日期: {file_date})，开始生成新报告...")
-        # 2. 运行简报生成
-        md_file_path = await finance_info()
-        
-        if md_file_path is None:
-            print("简报生成失败，跳过分析步骤")
-            return
-        
-        # 3. 再次检查文件中的日期是否与今天一致
-        date_matches, file_date = check_report_date(md_file_path)
-        
-        if not date_matches:
-            print(f"⚠ 生成的报告日期 ({file_date}) 与今天不一致，跳过分析步骤")
-            return
-    
-    # 4. 如果日期匹配，调用分析函数
-    if date_matches:
+
+    # 1. 先检查今天是否已经成功生成了报告（一次读取同时拿到正文，命中时免二次 I/O）
+    date_matches, report_body, file_date = await load_report_if_today(md_file_path)
+
+    analysis_task = None
+    async with asyncio.TaskGroup() as tg:
+        # Gemini 预热任务：与后面的生成/读取步骤并行跑
+        tg.create_task(_warm_gemini())
+
+        if date_matches:
+            print(f"✓ 检测到今天的报告已存在 (日期: {file_date})，跳过生成步骤，直接开始分析...")
+        else:
+            print(f"⚠ 未找到今天的报告 (文件日期: {file_date})，开始生成新报告...")
+            # 2. 运行简报生成（预热任务在后台继续；分析任务在简报落盘时就已启动）
+            md_file_path, analysis_task = await finance_info()
+
+            if md_file_path is None:
+                print("简报生成失败，跳过分析步骤")
+                return
+
+            # 3. 再次检查文件中的日期是否与今天一致
+            date_matches, file_date = await check_report_date(md_file_path)
+
+            if not date_matches:
+                print(f"⚠ 生成的报告日期 ({file_date}) 与今天不一致，跳过分析步骤")
+                if analysis_task is not None:
+                    analysis_task.cancel()
+                return
+
+        # 4. 如果日期匹配，调用分析函数（冷路径下任务已在 finance_info 里启动）
         print(f"\n✓ 报告日期 ({file_date}) 与今天一致，开始分析...")
-        analysis_result = await analyze_report(md_file_path)
-        print("="*20 + " 分析结果 " + "="*20)
-        print(analysis_result)
-        
+        if analysis_task is None:
+            analysis_task = tg.create_task(analyze_report(md_file_path, report_body=report_body))
+
+    if analysis_task is not None:
+        # 正文在 analyze_report 里已经流式打印过了，这里只落盘并确认路径
+        analysis_result = await analysis_task
+
         # 保存分析结果
         analysis_file = md_file_path.replace("daily_briefing.md", "analysis.md")
-        with open(analysis_file, "w", encoding="utf-8") as f:
-            f.write(f"Analysis Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-            f.write(analysis_result)
+        async with aiofiles.open(analysis_file, "w", encoding="utf-8") as f:
+            await f.write(f"Analysis Date: {datetime.now().isoformat(sep=' ', timespec='seconds')}\n\n")
+            await f.write(analysis_result)
         print(f"\n分析结果已保存到 {analysis_file}")
 
 
+async def run_batch_async(portfolios: list[dict], concurrency: int = 1) -> list[str]:
+    """
+    批量模式：逐份处理多份组合的简报生成 + 分析（回补/多组合场景）。
+
+    注意：当前必须串行执行 —— finance server 端只有一个全局会话购物车
+    (SESSION_STATE)，简报也固定写 finance_temp_data/daily_briefing.md，
+    并发运行会互相覆盖价格/新闻数据和输出文件。concurrency 参数预留给
+    将来 server 支持按会话隔离后再放开，目前传 >1 会被忽略并按串行跑。
+
+    Args:
+        portfolios: 组合配置列表（当前逐个复用默认监控列表，配置项预留给自定义 watchlist）
+        concurrency: 最大并发数（当前仅支持 1，见上方说明）
+
+    Returns:
+        每个组合的分析结果列表（失败的条目为错误描述字符串）
+    """
+    if concurrency > 1:
+        print(f"⚠ server 会话状态是全局的，暂不支持并发，忽略 concurrency={concurrency} 按串行执行")
+
+    results = []
+    for portfolio in portfolios:
+        md_file_path, analysis_task = await finance_info()
+        if md_file_path is None:
+            results.append("简报生成失败")
+        elif analysis_task is not None:
+            results.append(await analysis_task)
+        else:
+            results.append(await analyze_report(md_file_path))
+    return results
+
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
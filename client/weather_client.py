@@ -1,26 +1,49 @@
 import asyncio
-from json import load
+import json
 import os
+import time
 from dotenv import load_dotenv
 from datetime import datetime
 from mcp_agent import FastAgent, RequestParams
-import requests
+import httpx
 
 load_dotenv()
 
-def get_current_location():
+# 定位结果的磁盘缓存：IP 对应的城市短时间内不会变，
+# 1 小时内的重复简报直接复用，不再每次都打外网 API
+_LOC_CACHE_PATH = ".loc_cache.json"
+_LOC_CACHE_TTL = 3600  # 秒
+
+
+async def get_current_location():
     """
-    通过公共 IP API 获取当前城市。
+    通过公共 IP API 获取当前城市（异步请求 + 1 小时磁盘缓存）。
     """
+    # 0. 先查磁盘缓存
+    try:
+        with open(_LOC_CACHE_PATH, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if time.time() - cached["ts"] < _LOC_CACHE_TTL:
+            print(f"定位成功（缓存）：{cached['city']}")
+            return cached["city"]
+    except (OSError, ValueError, KeyError):
+        pass
+
     try:
         print("正在自动定位...")
 
-        response = requests.get('http://ip-api.com/json', timeout=5)
+        async with httpx.AsyncClient() as http:
+            response = await http.get('http://ip-api.com/json', timeout=5)
         data = response.json()
-        
+
         if data['status'] == 'success':
             city = data.get('city', 'unkown')
             print(f"定位成功：{city}")
+            try:
+                with open(_LOC_CACHE_PATH, "w", encoding="utf-8") as f:
+                    json.dump({"city": city, "ts": time.time()}, f)
+            except OSError:
+                pass
             return city
         else:
             print("定位失败，使用默认城市")
@@ -72,7 +95,7 @@ async def weather_info():
 
         current_time = datetime.now().strftime("%Y年%m月%d日 %H:%M") # 格式化时间
         week_day = datetime.now().strftime("%A")
-        city = get_current_location()
+        city = await get_current_location()
         
         daily_task = f"地点：{city}, 日期:{current_time}, {week_day}。请开始撰写今日简报"
 
@@ -1,15 +1,21 @@
+import asyncio
 import concurrent.futures
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
+import numpy as np
+import pandas as pd
 import yfinance as yf
-import json
+import orjson
 from datetime import datetime
-from groq import Groq
+from groq import AsyncGroq
+import httpx
 import requests
 import os
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+import lxml.html
+import pickle
 import trafilatura
-from time import sleep
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 # 1. 初始化环境
 load_dotenv()
@@ -18,56 +24,217 @@ groq_api_key = os.getenv("OPENAI_API_KEY")
 if not groq_api_key:
     print("Warning: OPENAI_API_KEY (for Groq) not found.")
 
-groq_client = Groq(api_key=groq_api_key)
+# 异步客户端：总结走事件循环并发，不再占用线程池
+groq_aclient = AsyncGroq(api_key=groq_api_key)
 mcp = FastMCP("finance")
 
+# Groq 并发上限：并发总结时别一次把限流额度打满
+_SUMMARIZE_CONCURRENCY = 6
+
+# 总结模型：抽取式摘要用 instant 档的 8B 就够了（格式约束都在提示里），
+# 首 token 延迟和单价都比 17B 低；可用环境变量 SUMMARY_MODEL 换回大模型做 A/B
+_SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "llama-3.1-8b-instant")
+
+# 摘要缓存：同一 (规范化 URL, 指令) 在 TTL 内直接复用，
+# 一天内的重复简报约一半的模型调用可以省掉
+_SUMMARY_CACHE: dict[tuple[str, str], tuple[float, str]] = {}
+_SUMMARY_CACHE_TTL = 6 * 3600  # 秒
+
+# 摘要系统提示：模块级常量，保证每次调用的前缀字节级一致，
+# 这样 provider 侧的自动 prompt 缓存才能命中（静态前缀在前，动态正文在后）。
+# 刻意写得电报式精简：每篇文章都要付一遍这里的输入 token
+_SUMMARY_SYSTEM_PROMPT = (
+    "Financial news extractor. Output strictly:\n"
+    "### 1. EXECUTIVE SUMMARY\n"
+    "### 2. HARD DATA (numbers/dates)\n"
+    "### 3. KEY QUOTES\n"
+    "<400 words. Telegraphic."
+)
+
+# 正文截断长度：新闻正文 6000 字符（约 1500 token）足够覆盖绝大多数报道，
+# 再长基本是重复引用和背景铺垫，白白拉高 prefill 延迟和输入账单
+_SUMMARY_TEXT_LIMIT = 6000
+
+# user 消息模板同样挂在模块级：每次调用只填两个动态槽位，
+# 指令部分字节级一致，和系统提示一起构成可复用的稳定前缀
+_SUMMARY_USER_TMPL = "User INSTRUCTION: {focus}\n\nCONTENT:\n{text}"
+
+
+def _canonicalize_url(url: str) -> str:
+    """去掉 utm 跟踪参数和 fragment，让同一篇文章的链接变体命中同一个缓存键"""
+    try:
+        parts = urlsplit(url.strip())
+        query = [(k, v) for k, v in parse_qsl(parts.query) if not k.lower().startswith("utm_")]
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+    except ValueError:
+        return url.strip().lower()
+
 # === 🌟 核心升级: 全局会话状态 (The Session State) ===
 # 这就像一个“购物车”，用来暂存 Agent 挑选的数据
 SESSION_STATE = {
     "prices": {},       # 存股价: {"NVDA": {...}, "AAPL": {...}}
     "raw_news": [],     # 存原始新闻: [{"id": 0, "title": "...", "url": "...", "ticker": "..."}]
-    "summaries": []     # 存总结好的新闻: [{"id": 0, "summary": "..."}]
+    "summaries": {}     # 存总结好的新闻: {0: {"id": 0, "summary": "..."}}，按 id 索引，删除 O(1)
 }
 
+# 会话状态落盘：server 重启（或中途崩溃）后购物车不丢，
+# Agent 可以接着上次选好的新闻继续导出报告。
+# pickle 能直接存 price_history 里的 numpy 数组 (ts/close)，不用额外序列化
+_SESSION_STATE_PATH = os.path.join("finance_temp_data", ".session_state.pkl")
+
+
+def _save_session():
+    """把当前会话状态原子写入磁盘（先写临时文件再替换，避免写一半被读到）"""
+    try:
+        os.makedirs(os.path.dirname(_SESSION_STATE_PATH), exist_ok=True)
+        tmp_path = _SESSION_STATE_PATH + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(SESSION_STATE, f)
+        os.replace(tmp_path, _SESSION_STATE_PATH)
+    except Exception as e:
+        print(f"Warning: failed to persist session state: {e}")
+
+
+def _load_session():
+    """启动时恢复上一次的会话状态（没有或损坏时保持空状态）"""
+    try:
+        with open(_SESSION_STATE_PATH, "rb") as f:
+            saved = pickle.load(f)
+        for key in SESSION_STATE:
+            if key in saved:
+                SESSION_STATE[key] = saved[key]
+        # 兼容旧快照：summaries 以前是 list，现在按 id 建索引
+        if isinstance(SESSION_STATE["summaries"], list):
+            SESSION_STATE["summaries"] = {s['id']: s for s in SESSION_STATE["summaries"]}
+        print("Session state restored from disk.")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Warning: failed to restore session state: {e}")
+
+
+_load_session()
+
+# stock.info 的 TTL 缓存：shortName/previousClose 在一个交易时段内基本不变，
+# 60 秒内对同一 ticker 的重复请求直接复用，省掉 yfinance 的整页 JSON 抓取
+_INFO_CACHE: dict[str, tuple[float, dict]] = {}
+_INFO_CACHE_TTL = 60  # 秒
+
+# 共享线程池：给单 ticker 内部的 history/info 并行请求用
+# （外层 fetch_and_store_prices 的池按 ticker 并发，这里按请求并发）
+_IO_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=20)
+
+# price_history 时间戳约定自检：写入端按纳秒存 (as_unit("ns").asi8)，
+# 读取端按纳秒解 (unit="ns")。pandas 哪天换了默认分辨率，这里会在
+# 启动时直接报错，而不是让导出报告里的趋势线静默错位到 1970 年
+_ts_probe = pd.DatetimeIndex(["2020-01-02T03:04:05"], tz="UTC")
+assert pd.to_datetime(_ts_probe.as_unit("ns").asi8, utc=True, unit="ns")[0] == _ts_probe[0], \
+    "price_history timestamp round-trip mismatch"
+del _ts_probe
+
+
 def _reset_session():
     """清空购物车，开始新的一轮分析"""
     SESSION_STATE["prices"] = {}
     SESSION_STATE["raw_news"] = []
-    SESSION_STATE["summaries"] = []
+    SESSION_STATE["summaries"] = {}
+    _save_session()
+
+_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+# 异步工具共用的 httpx 客户端：新闻搜索和文章抓取都走这里，
+# 连接保活复用省掉每篇文章重复的 TCP/TLS 握手，
+# 下载纯走事件循环，线程只留给 CPU 密集的正文提取
+_ASYNC_HTTP = httpx.AsyncClient(
+    timeout=15.0,
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=20),
+    headers={"User-Agent": _UA},
+)
+
+# yfinance 共享会话：所有 Ticker/download 走同一个保活连接池，
+# Yahoo 的 cookie+crumb 引导整个进程只做一次，不再每个线程各来一遍
+_YF_SESSION = requests.Session()
+_YF_SESSION.headers["User-Agent"] = _UA
+
+
+def _warm_yf_session():
+    """启动时后台预热 cookie+crumb，首次用户请求不用付引导开销"""
+    try:
+        yf.Ticker("AAPL", session=_YF_SESSION).fast_info["lastPrice"]
+    except Exception:
+        pass
+
+
+_IO_POOL.submit(_warm_yf_session)
 
 # === 2. 爬虫工具 (保留你现有的 Trafilatura 逻辑) ===
-def _fetch_text(url: str) -> str:
+def _extract_with_lxml(html: str) -> str:
+    """
+    lxml (C 实现) 的兜底提取：trafilatura 识别不出正文时，
+    直接收集正文段落，比纯 Python 的 DOM 遍历快一个数量级。
+    """
+    tree = lxml.html.fromstring(html)
+    # 去掉脚本/样式/导航等噪音节点
+    for node in tree.cssselect('script, style, nav, footer, header'):
+        node.drop_tree()
+    paras = [
+        t for t in (p.text_content().strip() for p in tree.cssselect('p'))
+        if len(t) > 10
+    ]
+    return "\n".join(paras)
+
+
+def _extract_text(downloaded: str) -> str:
     """
-    使用 trafilatura 库进行本地智能提取。
+    使用 trafilatura 库进行本地智能提取，失败时回退到 lxml 快速解析。
     """
     try:
-        # 1. 下载 (它会自动处理 User-Agent 和简单的反爬重试)
-        downloaded = trafilatura.fetch_url(url)
-        
-        if not downloaded:
-            return "Error: Failed to download page."
-            
-        # 2. 提取 (智能识别正文，忽略侧边栏和广告)
+        # 1. 提取 (智能识别正文，忽略侧边栏和广告)
         text = trafilatura.extract(
-            downloaded, 
-            include_comments=False, 
+            downloaded,
+            include_comments=False,
             include_tables=True,
             no_fallback=True
         )
-        
+
+        # 2. trafilatura 提取为空时用 lxml 兜底再试一次
+        if not text or len(text) < 200:
+            try:
+                text = _extract_with_lxml(downloaded)
+            except Exception:
+                text = None
+
         if not text or len(text) < 200:
             return "Error: Extracted content empty or too short."
-            
+
         return text
 
     except Exception as e:
         return f"Error: {str(e)}"
 
+
+async def _afetch_text(url: str) -> str:
+    """
+    异步抓取文章正文：下载走共享 httpx 客户端（事件循环多路复用），
+    CPU 密集的正文提取丢线程，抓取阶段不再按篇占线程。
+    """
+    try:
+        resp = await _ASYNC_HTTP.get(url)
+        downloaded = resp.text if resp.status_code < 400 else None
+    except httpx.HTTPError:
+        downloaded = None
+
+    if not downloaded:
+        return "Error: Failed to download page."
+
+    return await asyncio.to_thread(_extract_text, downloaded)
+
 # ==========================================
 # 🛒 Tool 1: 存股价 (Add Prices to Cart)
 # ==========================================
 @mcp.tool()
-def fetch_and_store_prices(tickers: list[str], prepost: bool = True) -> str:
+async def fetch_and_store_prices(tickers: list[str], prepost: bool = True) -> str:
     """
     Fetch and store stock prices for given ticker symbols.
     
@@ -81,32 +248,62 @@ def fetch_and_store_prices(tickers: list[str], prepost: bool = True) -> str:
     if not tickers:
         return "No tickers provided."
 
+    # 从批量下载结果里切出单个 ticker 的分时数据（切不出来返回 None，走兜底）
+    def _slice_batch(batch, ticker):
+        try:
+            if batch is None or batch.empty:
+                return None
+            if isinstance(batch.columns, pd.MultiIndex):
+                if ticker not in batch.columns.get_level_values(0):
+                    return None
+                hist = batch[ticker]
+            else:
+                hist = batch
+            return hist.dropna(subset=["Close"])
+        except Exception:
+            return None
+
     # 定义单个抓取逻辑 (复用你之前的逻辑)
-    def fetch_single_ticker(ticker):
+    def fetch_single_ticker(ticker, hist=None):
         try:
-            stock = yf.Ticker(ticker)
-            # 策略: 优先取 1天，如果是周末/休市取不到，则回退取 5天
-            hist = stock.history(period="1d", interval="1h", prepost=prepost)
+            stock = yf.Ticker(ticker, session=_YF_SESSION)
+
+            def _safe_info():
+                cached = _INFO_CACHE.get(ticker)
+                if cached and time.time() - cached[0] < _INFO_CACHE_TTL:
+                    return cached[1]
+                try:
+                    info = stock.info
+                except Exception:
+                    return {}
+                _INFO_CACHE[ticker] = (time.time(), info)
+                return info
+
+            # info 是独立的 Yahoo 请求，和 history 兜底并行发出去
+            info_future = _IO_POOL.submit(_safe_info)
+
+            # 策略: 批量结果为空时单独取 1天，周末/休市再回退取 5天
+            if hist is None or hist.empty:
+                hist = stock.history(period="1d", interval="1h", prepost=prepost)
             if hist.empty:
                 hist = stock.history(period="5d", interval="1h", prepost=prepost)
-            
+
             if hist.empty:
+                info_future.cancel()
                 return {"symbol": ticker, "status": "No Data", "error": "Market Closed/No Data"}
-            
+
             current_price = hist['Close'].iloc[-1]
-            
+
             # 计算涨跌幅
             last_date = hist.index[-1].date()
             day_data = hist[hist.index.date == last_date]
-            
+
             if not day_data.empty:
                 open_price = day_data['Open'].iloc[0]
             else:
                 open_price = hist['Open'].iloc[-1]
-            
-            info = {}
-            try: info = stock.info
-            except: pass
+
+            info = info_future.result()
 
             prev_close = info.get('previousClose')
             base_price = prev_close if prev_close else open_price
@@ -121,38 +318,70 @@ def fetch_and_store_prices(tickers: list[str], prepost: bool = True) -> str:
                 "change": round(change_percent, 2),
                 "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "status": 'Active',
-                "price_history": hist['Close']
+                # 紧凑的列式存储：两个 numpy 数组比整个 pandas Series
+                # （BlockManager + Index 包装）省一个数量级内存，也方便落盘
+                "price_history": {
+                    # asi8 返回的是索引自身分辨率的裸 int64（pandas 3 下是微秒），
+                    # 先统一成纳秒，存取两端的约定才跨 pandas 版本稳定
+                    "ts": hist.index.as_unit("ns").asi8,            # int64 纳秒时间戳 (UTC)
+                    "close": hist['Close'].to_numpy(dtype=np.float32),
+                    "tz": str(hist.index.tz) if hist.index.tz is not None else None,
+                }
             }
         except Exception as e:
             return {"symbol": ticker, "status": "Error", "error": str(e)}
 
-    # 并发执行
-    results_summary = []
-    max_workers = min(len(tickers), 10)
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_ticker = {executor.submit(fetch_single_ticker, t): t for t in tickers}
-        
-        for future in concurrent.futures.as_completed(future_to_ticker):
-            data = future.result()
-            ticker = data["symbol"]
-            
-            # 存入全局 Session
-            SESSION_STATE["prices"][ticker] = data
-            
-            # 生成简报字符串返回给 Client
-            if data["status"] == "Active":
-                results_summary.append(f"{ticker}: {data['change']}%")
-            else:
-                results_summary.append(f"{ticker}: {data['status']}")
-            
-    return f"Prices stored in server. Quick View: {', '.join(results_summary)}"
+    # 并发执行（yfinance 是阻塞库，整段抓取丢线程跑，不卡 FastMCP 的事件循环，
+    # 这样股价抓取和新闻总结可以真正并行）
+    def _run_blocking():
+        results_summary = []
+        max_workers = min(len(tickers), 10)
+
+        # 一次批量 chart 请求拿到所有 ticker 的分时数据，请求数从 N 降到 1；
+        # 失败或缺数据的 ticker 在 fetch_single_ticker 里走单独请求兜底
+        try:
+            batch = yf.download(
+                tickers=" ".join(tickers),
+                period="1d",
+                interval="1h",
+                prepost=prepost,
+                group_by="ticker",
+                threads=True,
+                progress=False,
+                session=_YF_SESSION,
+            )
+        except Exception:
+            batch = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_ticker = {
+                executor.submit(fetch_single_ticker, t, _slice_batch(batch, t)): t
+                for t in tickers
+            }
+
+            for future in concurrent.futures.as_completed(future_to_ticker):
+                data = future.result()
+                ticker = data["symbol"]
+
+                # 存入全局 Session
+                SESSION_STATE["prices"][ticker] = data
+
+                # 生成简报字符串返回给 Client
+                if data["status"] == "Active":
+                    results_summary.append(f"{ticker}: {data['change']}%")
+                else:
+                    results_summary.append(f"{ticker}: {data['status']}")
+
+        _save_session()
+        return f"Prices stored in server. Quick View: {', '.join(results_summary)}"
+
+    return await asyncio.to_thread(_run_blocking)
 
 # ==========================================
 # 🛒 Tool 2: 查新闻菜单 (Search & Menu)
 # ==========================================
 @mcp.tool()
-def search_news_options(tickers: list[str], limit: int = 4) -> str:
+async def search_news_options(tickers: list[str], limit: int = 4) -> str:
     """
     Search and retrieve news article options for given stock tickers.
     
@@ -164,93 +393,105 @@ def search_news_options(tickers: list[str], limit: int = 4) -> str:
     """
     if not tickers:
         return "No tickers provided."
-        
+
+    # 输入护栏：去掉空项、重复 ticker（保序去重），limit 按文档说明夹在 1-4。
+    # 重复 ticker 会触发成倍的冗余请求，结果反正也会被去重掉
+    tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t and t.strip()))
+    if not tickers:
+        return "No tickers provided."
+    limit = max(1, min(limit, 4))
+
     SESSION_STATE["raw_news"] = [] # 清空旧新闻列表
     global_index = 0
     menu_output = []
-    
-    # 用于去重的集合：跟踪已见过的 URL 和标题
-    seen_urls = set()
-    seen_titles = set()
-    
-    # 内部函数：获取单只股票新闻
-    def fetch_single_news(ticker):
-        try:
-            stock = yf.Ticker(ticker)
-            news_list = stock.news
-            if not news_list: return []
-            
-            valid_items = []
-            safe_limit = min(limit, len(news_list))
-            
-            for item in news_list[:safe_limit]:
-                # 复用你的解析逻辑
-                data = item.get('content', item)
-                title = data.get('title', 'No Title')
-                
-                # 提取链接
-                link = None
-                if 'clickThroughUrl' in data and data['clickThroughUrl']:
-                    link = data['clickThroughUrl'].get('url')
-                if not link and 'canonicalUrl' in data and data['canonicalUrl']:
-                    link = data['canonicalUrl'].get('url')
-                if not link:
-                    link = data.get('link') or data.get('url')
-                    
-                if link and title != "No Title":
-                    valid_items.append({"ticker": ticker, "title": title, "url": link})
-            return valid_items
-        except:
-            return []
-
-    # 并发抓取新闻元数据
-    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(tickers), 10)) as executor:
-        future_to_ticker = {executor.submit(fetch_single_news, t): t for t in tickers}
-        
-        for future in concurrent.futures.as_completed(future_to_ticker):
-            items = future.result()
-            for item in items:
-                # 去重检查：如果 URL 或标题已存在，则跳过
-                url = item["url"]
-                title = item["title"]
-                
-                # 标准化 URL 和标题用于比较（去除首尾空格，转为小写）
-                url_normalized = url.strip().lower() if url else ""
-                title_normalized = title.strip().lower() if title else ""
-                
-                # 如果 URL 或标题已存在，跳过这条新闻
-                if url_normalized in seen_urls or title_normalized in seen_titles:
+
+    # 用于去重的集合：存规范化 URL / 标题的整数哈希而不是完整字符串，
+    # 查找是整数比较，内存也不随标题长度增长
+    seen_urls: set[int] = set()
+    seen_titles: set[int] = set()
+
+    # 内部函数：直接打 Yahoo 的新闻搜索 JSON 接口拿单只股票新闻。
+    # 纯网络 I/O，用事件循环多路复用 socket，不再按 ticker 占线程
+    async def fetch_single_news(http, ticker):
+        # 网络错误指数退避重试：一次瞬时 5xx 不再静默吞掉整个 ticker 的新闻，
+        # 省得用户整个工具重调一遍；解析错误不重试（重试也没用），打日志后放弃
+        for attempt in range(3):
+            try:
+                resp = await http.get(
+                    "https://query1.finance.yahoo.com/v1/finance/search",
+                    params={"q": ticker, "newsCount": limit, "quotesCount": 0},
+                )
+                resp.raise_for_status()
+                news_list = resp.json().get("news") or []
+
+                valid_items = []
+                for item in news_list[:limit]:
+                    title = item.get('title', 'No Title')
+                    link = item.get('link') or item.get('url')
+
+                    if link and title != "No Title":
+                        valid_items.append({"ticker": ticker, "title": title, "url": link})
+                return valid_items
+            except httpx.HTTPError as e:
+                if attempt < 2:
+                    await asyncio.sleep(0.2 * (2 ** attempt))
                     continue
-                
-                # 添加到已见集合
-                if url_normalized:
-                    seen_urls.add(url_normalized)
-                if title_normalized:
-                    seen_titles.add(title_normalized)
-                
-                # 存入全局列表，分配 ID
-                entry = {
-                    "id": global_index,
-                    "ticker": item["ticker"],
-                    "title": item["title"],
-                    "url": item["url"]
-                }
-                SESSION_STATE["raw_news"].append(entry)
-                
-                # 生成菜单项
-                menu_output.append(f"[{global_index}] {item['ticker']} | {item['title']}")
-                global_index += 1
-    
+                print(f"Warning: news fetch failed for {ticker} after 3 attempts: {e}")
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Warning: unexpected news payload for {ticker}: {e}")
+                break
+        return []
+
+    # 并发抓取新闻元数据：共享客户端 + gather 扇出，
+    # 总耗时 ≈ 最慢的一个请求，而不是逐个相加
+    results = await asyncio.gather(*(fetch_single_news(_ASYNC_HTTP, t) for t in tickers))
+
+    for items in results:
+        for item in items:
+            # 去重检查：如果 URL 或标题已存在，则跳过
+            url = item["url"]
+            title = item["title"]
+
+            # 规范化后取哈希：URL 去掉跟踪参数/fragment（同一篇文章的链接
+            # 变体归到同一个键），标题用 casefold 做大小写无关比较
+            url_hash = hash(_canonicalize_url(url)) if url else None
+            title_hash = hash(title.strip().casefold()) if title else None
+
+            # 如果 URL 或标题已存在，跳过这条新闻
+            if url_hash in seen_urls or title_hash in seen_titles:
+                continue
+
+            # 添加到已见集合
+            if url_hash is not None:
+                seen_urls.add(url_hash)
+            if title_hash is not None:
+                seen_titles.add(title_hash)
+
+            # 存入全局列表，分配 ID
+            entry = {
+                "id": global_index,
+                "ticker": item["ticker"],
+                "title": item["title"],
+                "url": item["url"]
+            }
+            SESSION_STATE["raw_news"].append(entry)
+
+            # 生成菜单项
+            menu_output.append(f"[{global_index}] {item['ticker']} | {item['title']}")
+            global_index += 1
+
+    _save_session()
+
     if not menu_output:
         return "No news found."
-        
+
     return "Available News Options (Select by ID):\n" + "\n".join(menu_output)
 
 # ==========================================
 # 🛒 Tool 3: 选新闻并总结 (Checkout)
 # ==========================================
 @mcp.tool()
-def summarize_selected_indices(indices: list[int], focus_instruction: str = "General summary") -> str:
+async def summarize_selected_indices(indices: list[int], focus_instruction: str = "General summary", ctx: Context = None) -> str:
     """
     Fetch and summarize selected news articles by their indices.
     
@@ -272,62 +513,100 @@ def summarize_selected_indices(indices: list[int], focus_instruction: str = "Gen
 
     print(f"Summarizing {len(selected_items)} selected articles...")
 
-    # 内部处理函数
-    def process_item(item):
+    semaphore = asyncio.Semaphore(_SUMMARIZE_CONCURRENCY)
+
+    # 批内不变的前缀只拼一次：系统提示 + focus 指令在整批文章间字节一致，
+    # provider 的隐式前缀缓存可以跨文章命中，每篇只有正文是新 token
+    user_prefix = _SUMMARY_USER_TMPL.format(focus=focus_instruction, text="")
+
+    # 内部处理函数：抓取 + LLM 调用都是 I/O，整条链路放进事件循环并发跑
+    async def process_item(item):
         url = item['url']
         ticker = item['ticker']
-        
-        # 1. 抓取
-        raw_text = _fetch_text(url)
-        if not raw_text or raw_text.startswith("Error"):
-            return {
-                "id": item['id'],
-                "ticker": ticker,
-                "summary": f"Failed to fetch content: {raw_text}"
-            }
-
-        # 2. 总结 (使用 Groq 17B)
-        system_prompt = (
-            "You are a high-efficiency financial news extractor. "
-            "Compress the article content into strict format:\n"
-            "### 1. EXECUTIVE SUMMARY\n"
-            "### 2. HARD DATA (Numbers/Dates)\n"
-            "### 3. KEY QUOTES\n"
-            "Constraints: Under 400 words. Be telegraphic."
-        )
-        user_prompt = f"User INSTRUCTION: {focus_instruction}\n\nCONTENT:\n{raw_text[:12000]}"
 
-        try:
-            chat_completion = groq_client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                temperature=0.1,
-            )
-            summary = chat_completion.choices[0].message.content
+        # 0. 查缓存：同一篇文章（去掉跟踪参数后）+ 同一指令直接复用旧摘要
+        cache_key = (_canonicalize_url(url), focus_instruction)
+        cached = _SUMMARY_CACHE.get(cache_key)
+        if cached and time.time() - cached[0] < _SUMMARY_CACHE_TTL:
+            print(f"  Cache hit: {ticker} | {item['title'][:50]}")
             return {
                 "id": item['id'],
                 "ticker": ticker,
                 "title": item['title'],
-                "summary": summary
+                "summary": cached[1]
             }
-        except Exception as e:
-            return {"id": item['id'], "ticker": ticker, "summary": f"Error: {str(e)}"}
 
-    # 并发总结
+        async with semaphore:
+            # 1. 抓取（trafilatura 是阻塞调用，丢线程池执行，不卡事件循环）
+            raw_text = await _afetch_text(url)
+            if not raw_text or raw_text.startswith("Error"):
+                return {
+                    "id": item['id'],
+                    "ticker": ticker,
+                    "summary": f"Failed to fetch content: {raw_text}"
+                }
+
+            # 2. 总结 (使用 Groq instant 档模型，原生异步客户端)
+            # user 内容同样保持"稳定指令在前、动态正文在后"，方便前缀缓存
+            user_prompt = user_prefix + raw_text[:_SUMMARY_TEXT_LIMIT]
+
+            try:
+                # 流式拉取：token 一到就消费，信号量可以更早让给下一篇文章，
+                # 整体吞吐跟着首 token 延迟走而不是完整生成时长。
+                # MCP 工具本身只能整体返回，所以这里在服务端聚合
+                stream = await groq_aclient.chat.completions.create(
+                    messages=[
+                        {"role": "system", "content": _SUMMARY_SYSTEM_PROMPT},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    model=_SUMMARY_MODEL,
+                    temperature=0.1,
+                    max_tokens=500,
+                    stream=True,
+                )
+                parts = []
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                summary = "".join(parts)
+                _SUMMARY_CACHE[cache_key] = (time.time(), summary)
+                return {
+                    "id": item['id'],
+                    "ticker": ticker,
+                    "title": item['title'],
+                    "summary": summary
+                }
+            except Exception as e:
+                print(f"Warning: summarization failed for {ticker} ({url}): {e}")
+                return {"id": item['id'], "ticker": ticker, "summary": f"Error: {str(e)}"}
+
+    # 并发总结：as_completed 逐篇收割，每出一篇就向客户端上报进度，
+    # Agent 侧能看到任务在推进，而不是对着一整批干等。
+    # MCP 工具只能整体返回，所以最终 JSON 仍是一次性给出
+    tasks = [asyncio.create_task(process_item(item)) for item in selected_items]
     new_summaries = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(process_item, item) for item in selected_items]
-        for future in concurrent.futures.as_completed(futures):
-            new_summaries.append(future.result())
-            
-    # 存入 Session (追加模式)
-    SESSION_STATE["summaries"].extend(new_summaries)
-    
+    for done_count, coro in enumerate(asyncio.as_completed(tasks), 1):
+        result = await coro
+        new_summaries.append(result)
+        print(f"  [{done_count}/{len(tasks)}] done: id={result['id']}")
+        if ctx is not None:
+            try:
+                await ctx.report_progress(done_count, len(tasks))
+            except Exception:
+                pass
+
+    # 恢复成 Agent 给的 indices 顺序，返回内容与完成先后无关
+    position = {item['id']: pos for pos, item in enumerate(selected_items)}
+    new_summaries.sort(key=lambda s: position[s['id']])
+
+    # 存入 Session (按 id 建索引，追加模式)
+    for summary in new_summaries:
+        SESSION_STATE["summaries"][summary['id']] = summary
+    _save_session()
+
     # 返回 JSON 给 Agent，方便它决定下一步
-    return json.dumps(new_summaries, ensure_ascii=False)
+    return orjson.dumps(new_summaries).decode()
 
 # ==========================================
 # 🛒 Tool 4: 删除新闻 (Remove News)
@@ -345,18 +624,16 @@ def remove_news_summaries(indices: list[int]) -> str:
         A JSON string containing the list of remaining summary indices after removal.
     """
     if not indices:
-        return json.dumps([item['id'] for item in SESSION_STATE["summaries"]], ensure_ascii=False)
-    
-    # 删除指定 indices 的新闻
-    indices_to_remove = set(indices)
-    SESSION_STATE["summaries"] = [
-        item for item in SESSION_STATE["summaries"] 
-        if item['id'] not in indices_to_remove
-    ]
-    
+        return orjson.dumps(list(SESSION_STATE["summaries"])).decode()
+
+    # 删除指定 indices 的新闻（dict 按键删除，不再整表重建）
+    for idx in indices:
+        SESSION_STATE["summaries"].pop(idx, None)
+
+    _save_session()
+
     # 返回剩余 indices
-    remaining_indices = [item['id'] for item in SESSION_STATE["summaries"]]
-    return json.dumps(remaining_indices, ensure_ascii=False)
+    return orjson.dumps(list(SESSION_STATE["summaries"])).decode()
 
 # ==========================================
 # 🛒 Tool 5: 导出报告 (Export)
@@ -369,43 +646,45 @@ def export_final_report() -> str:
     Args:
         (No parameters)
     """
-    sleep(50)
-    md = "# Daily Market Pulse\n\n"
-    
+    # 拼接策略：append 到列表最后一次 join，避免 += 每次都整段复制 (O(n²))
+    parts = ["# Daily Market Pulse\n\n"]
+
     # 1. 股价部分
-    md += "## Market Data\n"
+    parts.append("## Market Data\n")
     for ticker, data in SESSION_STATE["prices"].items():
         if data.get("status") == "Active":
             # 1. 基础信息
-            md += f"- **{ticker}**: {data['name']} ${data['price']} ({data['change']}%)\n"
-            
+            parts.append(f"- **{ticker}**: {data['name']} ${data['price']} ({data['change']}%)\n")
+
             # 2. 清洗并格式化分时数据 (Intraday Trend)
             history = data.get("price_history")
-            
-            # 检查 history 是否是 Pandas Series (因为有时候可能存成 list)
-            if hasattr(history, 'index') and not history.empty:
-                # 列表推导式：只取 "时:分" 和 "价格"
-                trend_points = [
-                    f"{t.strftime('%H:%M')}:${p:.2f}" 
-                    for t, p in zip(history.index, history.values)
-                ]
+
+            # history 是 {"ts": int64 数组, "close": float32 数组, "tz": 时区}
+            if isinstance(history, dict) and len(history.get("ts", ())) > 0:
+                times = pd.to_datetime(history["ts"], utc=True, unit="ns")
+                if history.get("tz"):
+                    times = times.tz_convert(history["tz"])
+                # 向量化格式化：strftime/字符串拼接都在 C 层一次算完，
+                # 不再对每个数据点各做一次 Python 层的 format 调用
+                labels = np.asarray(times.strftime('%H:%M'), dtype=str)
+                prices = np.char.mod(':$%.2f', history["close"])
                 # 用箭头连接，既紧凑又直观
-                trend_line = " → ".join(trend_points)
-                md += f"  - *Price Trend*: {trend_line}\n"
+                trend_line = " → ".join(np.char.add(labels, prices))
+                parts.append(f"  - *Price Trend*: {trend_line}\n")
         else:
-            md += f"- **{ticker}**: {data.get('status')}\n"
-            
+            parts.append(f"- **{ticker}**: {data.get('status')}\n")
+
     # 2. 新闻部分
-    md += "\n## Key Developments\n"
+    parts.append("\n## Key Developments\n")
     if not SESSION_STATE["summaries"]:
-        md += "(No news selected)\n"
-    
-    for item in SESSION_STATE["summaries"]:
-        md += f"\n### [{item['ticker']}] {item.get('title', 'News')}\n"
-        md += f"{item['summary']}\n"
-        md += f"*(Ref ID: {item['id']})*\n"
-        
-    return md
+        parts.append("(No news selected)\n")
+
+    for item in SESSION_STATE["summaries"].values():
+        parts.append(f"\n### [{item['ticker']}] {item.get('title', 'News')}\n")
+        parts.append(f"{item['summary']}\n")
+        parts.append(f"*(Ref ID: {item['id']})*\n")
+
+    return "".join(parts)
 
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
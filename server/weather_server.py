@@ -1,6 +1,9 @@
 from mcp.server.fastmcp import FastMCP
+import asyncio
+import atexit
 import httpx
-import os 
+import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,6 +11,27 @@ API_KEY = os.getenv("WEATHER_API_KEY")
 
 mcp = FastMCP("weather", dependencies=['httpx'])
 
+# 模块级共享客户端：连接保活复用，省掉每次查询重建 TCP/TLS 的握手开销
+_client = httpx.AsyncClient(
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+)
+
+
+def _close_client():
+    try:
+        asyncio.run(_client.aclose())
+    except Exception:
+        pass  # 进程退出时连接反正会被回收
+
+
+atexit.register(_close_client)
+
+# 天气响应缓存：同一城市 5 分钟内的重复查询直接返回上次结果，
+# 省掉整个外网往返（天气数据本身的更新频率也到不了分钟级）
+_WEATHER_CACHE: dict[str, tuple[float, str]] = {}
+_WEATHER_CACHE_TTL = 300  # 秒
+
 @mcp.tool()
 async def getWeather(location: str) -> str:
     """
@@ -24,41 +48,48 @@ async def getWeather(location: str) -> str:
     if not location or not location.strip():
         return "错误：城市名称不能为空。"
     
+    # 查缓存：命中直接返回，不打外网
+    cache_key = location.strip().lower()
+    cached = _WEATHER_CACHE.get(cache_key)
+    if cached and time.time() - cached[0] < _WEATHER_CACHE_TTL:
+        return cached[1]
+
     url = "http://api.openweathermap.org/data/2.5/weather"
     params = {
         "q": location.strip(),
         "appid": API_KEY,
-        "units": "metric", 
-        "lang": "zh_cn"    
+        "units": "metric",
+        "lang": "zh_cn"
     }
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    try:
+        response = await _client.get(url, params=params)
+        response.raise_for_status()
+        data = response.json()
+
+        # 解析数据
+        weather_desc = data["weather"][0]["description"]
+        temp = data["main"]["temp"]
+        humidity = data["main"]["humidity"]
+
+        # 返回一段描述（只缓存成功结果，报错不缓存）
+        result = f"{location} 当前天气：{weather_desc}，温度：{temp}°C，湿度：{humidity}%。"
+        _WEATHER_CACHE[cache_key] = (time.time(), result)
+        return result
+
+    except httpx.HTTPStatusError as e:
+        error_detail = ""
         try:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            # 解析数据
-            weather_desc = data["weather"][0]["description"]
-            temp = data["main"]["temp"]
-            humidity = data["main"]["humidity"]
-            
-            # 返回一段描述
-            return f"{location} 当前天气：{weather_desc}，温度：{temp}°C，湿度：{humidity}%。"
-            
-        except httpx.HTTPStatusError as e:
-            error_detail = ""
-            try:
-                error_data = e.response.json()
-                if "message" in error_data:
-                    error_detail = f" ({error_data['message']})"
-            except:
-                pass
-            return f"查询失败：无法找到城市 '{location}' 或 API 请求错误 (状态码: {e.response.status_code}){error_detail}。"
-        except httpx.TimeoutException:
-            return f"查询超时：无法连接到天气服务。"
-        except Exception as e:
-            return f"发生未知错误: {str(e)}"
+            error_data = e.response.json()
+            if "message" in error_data:
+                error_detail = f" ({error_data['message']})"
+        except:
+            pass
+        return f"查询失败：无法找到城市 '{location}' 或 API 请求错误 (状态码: {e.response.status_code}){error_detail}。"
+    except httpx.TimeoutException:
+        return f"查询超时：无法连接到天气服务。"
+    except Exception as e:
+        return f"发生未知错误: {str(e)}"
 
 
 if __name__ == '__main__':